@@ -48,7 +48,7 @@ def getPostDict(cube, img_data, job, mime_type="image/png"):
     return payload
 
 
-def postImage(img_data, data, job):
+def postImage(img_data, data, job, start_time=None):
     """
     Sends the data to the data service via a post
 
@@ -57,19 +57,23 @@ def postImage(img_data, data, job):
         * data (cube): The cube metadata is used for the post
             metadata
         * job (Job): job
+        * start_time (float): time.time() at which the worker process
+            started. If given, the time from then until the post has
+            been sent is reported as the startup-to-first-byte.
     """
-    tempfilep = os.path.join(tempfile.gettempdir(), "temp.png")
-
-    with open(tempfilep, "wb") as img:
-        imageproc.writePng(img_data, img,
-                  nchannels=3, alpha=False)
-    payload = getPostDict(data, img_data, job)
-
-    print "Attempting to post image"
+    # a file per call, so that concurrent workers don't share it
+    fd, tempfilep = tempfile.mkstemp(suffix=".png")
     try:
+        with os.fdopen(fd, "wb") as img:
+            imageproc.writePng(img_data, img,
+                      nchannels=3, alpha=False)
+        payload = getPostDict(data, img_data, job)
+
+        print "Attempting to post image"
         with open(tempfilep, "rb") as img:
             # for attempt in range(100): # deals with connection errors etc
             r = requests.post(conf.img_data_server, data=payload, files={"data": img})
+            posted_time = time.time()
             time.sleep(2)
                 # if r.status_code == 201:
                 #     break
@@ -78,5 +82,7 @@ def postImage(img_data, data, job):
         else:
             print "Headers: ", r.headers
             print "Status code: ", r.status_code  
+            if start_time is not None:
+                print "Startup to first byte: %.2fs" % (posted_time - start_time)
     finally:
-        os.remove(tempfilep)
\ No newline at end of file
+        os.remove(tempfilep)
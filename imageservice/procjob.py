@@ -1,5 +1,8 @@
 #!/usr/bin/env python
 
+import time
+_start_time = time.time() # before the heavy imports, for startup timing
+
 import argparse as ap
 import iris
 import iris.util
@@ -89,9 +92,17 @@ def loadCube(data_file, topog_file, **kwargs):
 
     """
     opendapcube = iris.load_cube(data_file, **kwargs)
-    tempfilep = os.path.join(tempfile.gettempdir(), "temporary.pp")
-    iris.save(opendapcube, tempfilep)
-    data, topography = iris.load([tempfilep, topog_file])
+    # a file per call, so that concurrent workers don't share it
+    fd, tempfilep = tempfile.mkstemp(suffix=".pp")
+    os.close(fd)
+    try:
+        iris.save(opendapcube, tempfilep)
+        data, topography = iris.load([tempfilep, topog_file])
+        # iris loads lazily, so read everything in before the file goes
+        data.data
+        [crd.points for crd in data.aux_coords]
+    finally:
+        os.remove(tempfilep)
 
     if "altitude" not in [_.name() for _ in data.derived_coords]:
         # raise IOError("Derived altitude coord not present - probelm with topography?")
@@ -165,14 +176,36 @@ def getQueue(queue_name):
     return queue
 
 
-if __name__ == "__main__":
-    image_ready_queue = getQueue("image_ready_queue")
-    image_service_queue = getQueue("image_service_queue")
+def loadProfiles():
+    """
+    Builds the argparse Namespace for every analysis profile in the
+    config, keyed on profile name.
 
-    job = getJob(image_service_queue)
-    print "Picked up " + str(job)
+    """
+    return dict((name, ap.Namespace(**settings))
+                for name, settings in conf.profiles.items())
+
+
+def processJob(job, image_service_queue, image_ready_queue, profiles=None,
+               start_time=None):
+    """
+    Loads, processes and posts the image for a single job, then
+    removes the job from the image service queue.
 
-    profile = ap.Namespace(**conf.profiles[job.profile_name]) # get settings for this type of analysis
+    Args:
+        * job (Job): the job to process
+        * image_service_queue: the queue the job was taken from
+        * image_ready_queue: the queue to announce the posted image on
+        * profiles (dict): prebuilt profile Namespaces, as returned by
+            loadProfiles. Built from the config if not given.
+        * start_time (float): time.time() at which the worker process
+            started, used to report startup-to-first-byte
+
+    """
+    if profiles is None:
+        profile = ap.Namespace(**conf.profiles[job.profile_name]) # get settings for this type of analysis
+    else:
+        profile = profiles[job.profile_name]
 
     print "Loading data into Iris"
     print "job: ", job
@@ -186,10 +219,24 @@ if __name__ == "__main__":
                                              conf.img_data_server,
                                              profile)
 
-    post_object = networking.postImage(img_array, proced_data, job)
+    post_object = networking.postImage(img_array, proced_data, job,
+                                       start_time=start_time)
 
     postImgReady(job, image_ready_queue)
-    print "Image " + str(job) + " posted successfully. Exiting..."
+    print "Image " + str(job) + " posted successfully."
     
     image_service_queue.delete_message(job.message)
-    sys.exit()
\ No newline at end of file
+
+
+if __name__ == "__main__":
+    print "Imports took %.2fs" % (time.time() - _start_time)
+    image_ready_queue = getQueue("image_ready_queue")
+    image_service_queue = getQueue("image_service_queue")
+
+    job = getJob(image_service_queue)
+    print "Picked up " + str(job)
+
+    processJob(job, image_service_queue, image_ready_queue,
+               start_time=_start_time)
+    print "Exiting..."
+    sys.exit()
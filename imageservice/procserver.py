@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+import time
+_start_time = time.time() # before the heavy imports, for startup timing
+
+import argparse as ap
+import iris
+import os
+import traceback
+
+import sys
+sys.path.append(".")
+
+import procjob
+from config import analysis_config as conf
+
+"""
+procserver.py is a long running alternative to procjob.py.
+Rather than paying for the iris/numpy/boto imports and the
+config set up on every container invocation, it does all of
+this once, then forks a child worker process for each job.
+Children inherit the warm interpreter copy-on-write.
+
+Each child fetches its own job from the queue, so a bad
+message or a crashing job only takes down that child, exactly
+as with one procjob.py process per job.
+
+"""
+
+NO_JOBS_STATUS = 3 # worker exit code when the queue was empty
+
+
+def warmUp():
+    """
+    Does the one-off initialisation that every job would otherwise
+    repeat: builds the profile Namespaces and pulls in the iris file
+    loaders.
+
+    """
+    profiles = procjob.loadProfiles()
+    # only warms the loaders: loadCube has to load the topography
+    # alongside each job's data, so the cube itself can't be shared
+    iris.load(conf.topog_file)
+
+    return profiles
+
+
+def runWorker(profiles):
+    """
+    Fetches and processes a single job. Runs in the forked child,
+    and never returns.
+
+    The child makes its own queue connections rather than sharing
+    the supervisor's sockets. The startup-to-first-byte is timed
+    from the fork, so it covers the same steps as procjob.py.
+
+    """
+    status = 1
+    try:
+        fork_time = time.time()
+        image_ready_queue = procjob.getQueue("image_ready_queue")
+        image_service_queue = procjob.getQueue("image_service_queue")
+        job = procjob.getJob(image_service_queue)
+        print "Picked up " + str(job)
+        procjob.processJob(job, image_service_queue, image_ready_queue,
+                           profiles=profiles, start_time=fork_time)
+        status = 0
+    except procjob.NoJobsError:
+        status = NO_JOBS_STATUS
+    except Exception:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
+
+
+def spawnWorker(profiles):
+    """
+    Forks a worker. Returns its pid, or None if the fork failed.
+
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        pid = os.fork()
+    except OSError:
+        traceback.print_exc()
+        return None
+    if pid == 0:
+        runWorker(profiles)
+
+    return pid
+
+
+def exitCode(status):
+    """
+    Converts a waitpid status to an exit code, with deaths by
+    signal given as the negative signal number.
+
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+
+    return os.WEXITSTATUS(status)
+
+
+def reapChildren(children, block=False):
+    """
+    Waits on finished children, reporting how they exited, and
+    removes them from the children dict of pid: start time.
+    If block is True, waits for at least one child to finish.
+
+    Returns a list of the exit codes of the reaped children.
+
+    """
+    codes = []
+    while children:
+        pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+        if pid == 0:
+            break
+        block = False
+        start = children.pop(pid, None)
+        if start is None:
+            continue
+        code = exitCode(status)
+        codes.append(code)
+        took = " after %.2fs" % (time.time() - start)
+        if code < 0:
+            print "Worker " + str(pid) + " killed by signal " + str(-code) + took + \
+                  ". Its job will reappear on the queue."
+        elif code not in (0, NO_JOBS_STATUS):
+            print "Worker " + str(pid) + " failed with exit code " + str(code) + took + \
+                  ". Its job will reappear on the queue."
+
+    return codes
+
+
+def serve(nworkers=1, poll_interval=10):
+    """
+    Keeps up to nworkers pre-warmed workers running, each processing
+    one job from the queue. Waits poll_interval seconds before
+    trying again if the queue was empty or a fork failed.
+
+    """
+    profiles = warmUp()
+    print "Warm up took %.2fs" % (time.time() - _start_time)
+
+    children = {}
+    while True:
+        fork_failed = False
+        while len(children) < nworkers:
+            pid = spawnWorker(profiles)
+            if pid is None:
+                fork_failed = True
+                break
+            children[pid] = time.time()
+
+        codes = reapChildren(children, block=True)
+        if fork_failed or NO_JOBS_STATUS in codes:
+            time.sleep(poll_interval)
+
+
+if __name__ == "__main__":
+    parser = ap.ArgumentParser(description="Serve image service jobs from pre-warmed worker processes")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of jobs to process at once")
+    parser.add_argument("--poll-interval", type=float, default=10,
+                        help="seconds to wait when the queue is empty")
+    args = parser.parse_args()
+
+    serve(nworkers=args.workers, poll_interval=args.poll_interval)
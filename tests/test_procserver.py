@@ -0,0 +1,480 @@
+import unittest
+import argparse as ap
+import os
+import sys
+import types
+from StringIO import StringIO
+
+fileDir = os.path.dirname(__file__)
+srcDir = os.path.join(fileDir, os.pardir, "imageservice")
+
+
+def _stubModule(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+
+def _importWithStubs():
+    """
+    Imports the worker modules, standing in for any of iris, numpy,
+    boto, requests, png or the config that can't be imported here.
+    None of the code under test touches them, except through fakes
+    patched in by the tests.
+
+    The stubs, and the worker modules imported against them, are
+    taken back out of sys.modules afterwards so that later test
+    modules see the real packages.
+
+    """
+    iris_util = _stubModule("iris.util")
+    boto_sqs = _stubModule("boto.sqs")
+    stubs = {"iris": _stubModule("iris", util=iris_util,
+                                 FUTURE=types.ModuleType("FUTURE")),
+             "iris.util": iris_util,
+             "numpy": _stubModule("numpy"),
+             "png": _stubModule("png"),
+             "boto": _stubModule("boto", sqs=boto_sqs),
+             "boto.sqs": boto_sqs,
+             "requests": _stubModule("requests"),
+             "config": _stubModule("config",
+                                   analysis_config=_stubModule("analysis_config"))}
+    worker_modules = ["procserver", "procjob", "networking",
+                      "dataproc", "imageproc", "packer"]
+
+    saved_path = list(sys.path)
+    sys.path.insert(0, srcDir)
+    stubbed = []
+    try:
+        for name in sorted(stubs):
+            if name in sys.modules:
+                continue
+            try:
+                __import__(name)
+            except ImportError:
+                sys.modules[name] = stubs[name]
+                stubbed.append(name)
+        import procserver, procjob, networking
+    finally:
+        for name in stubbed + worker_modules:
+            sys.modules.pop(name, None)
+        sys.path[:] = saved_path
+
+    return procserver, procjob, networking
+
+procserver, procjob, networking = _importWithStubs()
+
+
+def exited(code):
+    return code << 8
+
+
+def killed(signum):
+    return signum
+
+
+class WorkerExit(Exception):
+    def __init__(self, status):
+        self.status = status
+
+
+class FakeOs(object):
+    """
+    Stands in for the os module as seen by procserver. Forked pids
+    count up from 100. Each waitpid call pops the next status from
+    statuses and reaps the oldest child still running with it,
+    except that a None means a non-blocking wait finds nothing
+    finished. _exit raises WorkerExit. Everything else is the real os.
+
+    """
+    def __init__(self, statuses=(), fail_forks=0, fork_pid=None):
+        self.statuses = list(statuses)
+        self.fail_forks = fail_forks
+        self.fork_pid = fork_pid
+        self.running = []
+        self.forked = []
+        self.waits = []
+        self.max_running = 0
+        self.next_pid = 100
+
+    def __getattr__(self, name):
+        return getattr(os, name)
+
+    def fork(self):
+        if self.fail_forks:
+            self.fail_forks -= 1
+            raise OSError("fork failed")
+        if self.fork_pid is not None:
+            return self.fork_pid
+        pid = self.next_pid
+        self.next_pid += 1
+        self.running.append(pid)
+        self.forked.append(pid)
+        self.max_running = max(self.max_running, len(self.running))
+        return pid
+
+    def waitpid(self, pid, options):
+        self.waits.append(options)
+        if options != 0 and self.statuses and self.statuses[0] is None:
+            self.statuses.pop(0)
+            return 0, 0
+        if not self.running or not self.statuses:
+            if options == 0:
+                raise AssertionError("blocking wait would never return")
+            return 0, 0
+        return self.running.pop(0), self.statuses.pop(0)
+
+    def _exit(self, status):
+        raise WorkerExit(status)
+
+
+class StopServing(Exception):
+    pass
+
+
+class FakeTime(object):
+    def __init__(self, stop_after=None):
+        self.sleeps = []
+        self.stop_after = stop_after
+
+    def time(self):
+        return 1000.0
+
+    def sleep(self, secs):
+        self.sleeps.append(secs)
+        if self.stop_after is not None and len(self.sleeps) >= self.stop_after:
+            raise StopServing()
+
+
+class FakeProcjob(object):
+    """
+    Stands in for procjob as seen by procserver's workers.
+
+    """
+    NoJobsError = procjob.NoJobsError
+
+    def __init__(self, job="job", error=None):
+        self.job = job
+        self.error = error
+        self.processed = []
+
+    def getQueue(self, name):
+        return name
+
+    def getJob(self, queue):
+        if self.job is None:
+            raise procjob.NoJobsError()
+        return self.job
+
+    def processJob(self, job, image_service_queue, image_ready_queue,
+                   profiles=None, start_time=None):
+        if self.error is not None:
+            raise self.error
+        self.processed.append((job, profiles))
+
+
+class PatchingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.patched = []
+        self.stdout, self.stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+
+    def tearDown(self):
+        for module, name, value in reversed(self.patched):
+            setattr(module, name, value)
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+
+    def patch(self, module, name, value):
+        self.patched.append((module, name, getattr(module, name)))
+        setattr(module, name, value)
+
+
+class SupervisorTests(PatchingTestCase):
+    def setUp(self):
+        PatchingTestCase.setUp(self)
+        self.patch(procserver, "warmUp", lambda: {})
+
+    def serve(self, fake_os, stop_after, nworkers=1):
+        fake_time = FakeTime(stop_after)
+        self.patch(procserver, "os", fake_os)
+        self.patch(procserver, "time", fake_time)
+        self.assertRaises(StopServing, procserver.serve,
+                          nworkers=nworkers, poll_interval=5)
+        return fake_time.sleeps
+
+    def test_exit_code(self):
+        self.assertEqual(procserver.exitCode(exited(0)), 0)
+        self.assertEqual(procserver.exitCode(exited(1)), 1)
+        self.assertEqual(procserver.exitCode(killed(9)), -9)
+
+    def test_reap_removes_finished_children(self):
+        fake = FakeOs([exited(0), killed(9)])
+        fake.running = [1, 2, 3]
+        self.patch(procserver, "os", fake)
+        children = {1: 0.0, 2: 0.0, 3: 0.0}
+
+        codes = procserver.reapChildren(children)
+
+        self.assertEqual(codes, [0, -9])
+        self.assertEqual(children.keys(), [3])
+
+    def test_reap_blocks_only_for_first_child(self):
+        fake = FakeOs([exited(1)])
+        fake.running = [1, 2]
+        self.patch(procserver, "os", fake)
+
+        codes = procserver.reapChildren({1: 0.0, 2: 0.0}, block=True)
+
+        self.assertEqual(codes, [1])
+        self.assertEqual(fake.waits, [0, os.WNOHANG])
+
+    def test_worker_limit(self):
+        # two workers finish one after another, the third
+        # finds the queue empty
+        fake = FakeOs([exited(0), None,
+                       exited(0), None,
+                       exited(procserver.NO_JOBS_STATUS), None])
+
+        sleeps = self.serve(fake, stop_after=1, nworkers=2)
+
+        # fork two, then one more each time a worker finishes
+        self.assertEqual(fake.forked, [100, 101, 102, 103])
+        self.assertEqual(fake.max_running, 2)
+        self.assertEqual(sleeps, [5])
+
+    def test_keeps_serving_after_no_jobs(self):
+        fake = FakeOs([exited(procserver.NO_JOBS_STATUS)] * 3)
+
+        sleeps = self.serve(fake, stop_after=3)
+
+        self.assertEqual(fake.forked, [100, 101, 102])
+        self.assertEqual(sleeps, [5, 5, 5])
+
+    def test_keeps_serving_after_failed_worker(self):
+        fake = FakeOs([exited(1), killed(11), exited(procserver.NO_JOBS_STATUS)])
+
+        sleeps = self.serve(fake, stop_after=1)
+
+        # failures are respawned straight away, only an empty queue waits
+        self.assertEqual(fake.forked, [100, 101, 102])
+        self.assertEqual(sleeps, [5])
+
+    def test_keeps_serving_after_failed_fork(self):
+        fake = FakeOs([exited(procserver.NO_JOBS_STATUS)], fail_forks=1)
+
+        sleeps = self.serve(fake, stop_after=2)
+
+        self.assertEqual(fake.forked, [100])
+        self.assertEqual(sleeps, [5, 5])
+
+
+class WorkerTests(PatchingTestCase):
+    def setUp(self):
+        PatchingTestCase.setUp(self)
+        self.patch(procserver, "os", FakeOs())
+
+    def runWorker(self, fake_procjob):
+        self.patch(procserver, "procjob", fake_procjob)
+        try:
+            procserver.runWorker({"default": "profile"})
+        except WorkerExit as e:
+            return e.status
+        self.fail("runWorker returned without calling os._exit")
+
+    def test_success(self):
+        fake = FakeProcjob()
+        self.assertEqual(self.runWorker(fake), 0)
+        self.assertEqual(fake.processed, [("job", {"default": "profile"})])
+
+    def test_no_jobs(self):
+        fake = FakeProcjob(job=None)
+        self.assertEqual(self.runWorker(fake), procserver.NO_JOBS_STATUS)
+        self.assertEqual(fake.processed, [])
+
+    def test_failed_job(self):
+        fake = FakeProcjob(error=KeyError("profile_name"))
+        self.assertEqual(self.runWorker(fake), 1)
+
+    def test_bad_message(self):
+        fake = FakeProcjob()
+        def getJob(queue):
+            raise ValueError("No JSON object could be decoded")
+        fake.getJob = getJob
+        self.assertEqual(self.runWorker(fake), 1)
+
+    def test_spawn_runs_worker_in_child(self):
+        fake = FakeProcjob()
+        self.patch(procserver, "os", FakeOs(fork_pid=0))
+        self.patch(procserver, "procjob", fake)
+
+        try:
+            procserver.spawnWorker({"default": "profile"})
+        except WorkerExit as e:
+            self.assertEqual(e.status, 0)
+        else:
+            self.fail("child returned from spawnWorker")
+        self.assertEqual(fake.processed, [("job", {"default": "profile"})])
+
+    def test_spawn_returns_pid_in_parent(self):
+        self.patch(procserver, "os", FakeOs(fork_pid=123))
+        self.assertEqual(procserver.spawnWorker({}), 123)
+
+
+class FakeCoord(object):
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+
+class FakeCube(object):
+    """
+    Just enough of a cube for loadCube. Records whether the
+    temporary file still existed when its data was read.
+
+    """
+    def __init__(self, tempfilep):
+        self.tempfilep = tempfilep
+        self.read_while_present = None
+        self.aux_coords = []
+        self.derived_coords = [FakeCoord("altitude")]
+
+    @property
+    def data(self):
+        self.read_while_present = os.path.exists(self.tempfilep)
+
+    def coords(self, dim_coords=True, axis=None):
+        return [axis] if axis in "XYZ" else []
+
+    def coord_dims(self, crd):
+        return ("XYZ".index(crd),)
+
+    def transpose(self, order):
+        pass
+
+
+class FakeIris(object):
+    def __init__(self, fail_load=False):
+        self.fail_load = fail_load
+        self.saved = []
+        self.cubes = []
+
+    def load_cube(self, data_file, **kwargs):
+        return "opendap cube"
+
+    def save(self, cube, tempfilep):
+        self.saved.append(tempfilep)
+        with open(tempfilep, "wb") as f:
+            f.write("pp")
+
+    def load(self, files):
+        if self.fail_load:
+            raise IOError("bad pp file")
+        cube = FakeCube(files[0])
+        self.cubes.append(cube)
+        return [cube, "topography"]
+
+
+class LoadCubeTests(PatchingTestCase):
+    def test_temp_file_per_call(self):
+        fake = FakeIris()
+        self.patch(procjob, "iris", fake)
+
+        procjob.loadCube("data.nc", "topog.pp")
+        procjob.loadCube("data.nc", "topog.pp")
+
+        first, second = fake.saved
+        self.assertNotEqual(first, second)
+        self.assertTrue(first.endswith(".pp"))
+        self.assertTrue(all(cube.read_while_present for cube in fake.cubes))
+        self.assertFalse(os.path.exists(first))
+        self.assertFalse(os.path.exists(second))
+
+    def test_temp_file_removed_on_failure(self):
+        fake = FakeIris(fail_load=True)
+        self.patch(procjob, "iris", fake)
+
+        self.assertRaises(IOError, procjob.loadCube, "data.nc", "topog.pp")
+
+        tempfilep, = fake.saved
+        self.assertFalse(os.path.exists(tempfilep))
+
+    def test_load_profiles(self):
+        conf = _stubModule("analysis_config",
+                           profiles={"default": {"extent": [0, 1, 2, 3]}})
+        self.patch(procjob, "conf", conf)
+
+        profiles = procjob.loadProfiles()
+
+        self.assertEqual(profiles.keys(), ["default"])
+        self.assertIsInstance(profiles["default"], ap.Namespace)
+        self.assertEqual(profiles["default"].extent, [0, 1, 2, 3])
+
+
+class FakeResponse(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = ""
+        self.headers = {}
+
+
+class FakeRequests(object):
+    """
+    Records the path and contents of each image posted.
+
+    """
+    def __init__(self, status_code=201):
+        self.status_code = status_code
+        self.posted = []
+
+    def post(self, url, data=None, files=None):
+        img = files["data"]
+        self.posted.append((img.name, img.read()))
+        return FakeResponse(self.status_code)
+
+
+class PostImageTests(PatchingTestCase):
+    def setUp(self):
+        PatchingTestCase.setUp(self)
+        def writePng(img_data, img, nchannels=3, alpha=False):
+            img.write(img_data)
+        self.patch(networking, "imageproc", _stubModule("imageproc", writePng=writePng))
+        self.patch(networking, "getPostDict", lambda data, img_data, job: {})
+        self.patch(networking, "conf", _stubModule("analysis_config",
+                                                   img_data_server="http://example"))
+        self.patch(networking, "time", FakeTime())
+
+    def test_temp_file_per_call(self):
+        fake = FakeRequests()
+        self.patch(networking, "requests", fake)
+
+        networking.postImage("first", None, None)
+        networking.postImage("second", None, None)
+
+        (first, first_img), (second, second_img) = fake.posted
+        self.assertNotEqual(first, second)
+        self.assertTrue(first.endswith(".png"))
+        self.assertEqual((first_img, second_img), ("first", "second"))
+        self.assertFalse(os.path.exists(first))
+        self.assertFalse(os.path.exists(second))
+
+    def test_timing_only_reported_on_success(self):
+        self.patch(networking, "requests", FakeRequests())
+        networking.postImage("img", None, None, start_time=990.0)
+        self.assertIn("Startup to first byte: 10.00s", sys.stdout.getvalue())
+
+    def test_rejected_post(self):
+        fake = FakeRequests(status_code=500)
+        self.patch(networking, "requests", fake)
+
+        self.assertRaises(IOError, networking.postImage, "img", None, None,
+                          start_time=990.0)
+
+        (tempfilep, _), = fake.posted
+        self.assertFalse(os.path.exists(tempfilep))
+        self.assertNotIn("Startup to first byte", sys.stdout.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()